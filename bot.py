@@ -1,31 +1,52 @@
-import openai
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from telegram import Update, BotCommand
-from telegram.ext import ApplicationBuilder, MessageHandler, filters, CommandHandler, ContextTypes
-from config.settings import TELEGRAM_TOKEN, OPENAI_API_KEY, SESSION_DURATION, HISTORY_CONTEXT_FILE
-from utils.memory_manager import MemoryManager
+from telegram.constants import ChatAction
+from telegram.ext import AIORateLimiter, ApplicationBuilder, MessageHandler, filters, CommandHandler, ContextTypes
+from config.settings import TELEGRAM_TOKEN, SEMANTIC_CACHE_ENABLED, CHAT_MODEL, STREAM_EDIT_INTERVAL, LOG_LEVEL, OPENAI_MAX_CONCURRENCY, MAX_CONTEXT_TURNS, MAX_CONTEXT_TOKENS, MEMORY_RETRIEVAL_ENABLED, MEMORY_RETRIEVAL_TOP_K, WEBHOOK_SECRET, HTTP_MAX_CONCURRENCY, BLOCKING_POOL_SIZE, runtime_config
+from utils.memory_manager import get_memory_manager, message_tokens
+from utils.openai_client import get_openai_client
+from utils.embeddings import embed_text
+from utils.memory_index import get_memory_index, backfill_memory_index
+from utils.file_writer import get_file_writer
+from utils.response_cache import ResponseCache
+from utils.tokens import count_tokens, get_encoding, trim_to_token_budget
 import logging
-from openai import OpenAIError
+import logging.handlers
+import queue
+import atexit
 import sys
 from utils.init_memory import init_memory_files
 from utils.context_updater import update_history_context
 from utils.whole_history_analyzer import periodic_history_analysis, analyze_whole_history
 import asyncio
+import hmac
+import uvicorn
 import os
 from dotenv import load_dotenv
-import json
-from contextlib import asynccontextmanager
+import orjson
+from contextlib import aclosing, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from functools import lru_cache, wraps
 
 # Setup logging first - move this to the very top, right after imports
+# Records are queued and written by a listener thread, so console and file I/O
+# never block the event loop
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [logging.StreamHandler(sys.stdout), logging.FileHandler('bot.log')]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('bot.log')
-    ],
+    level=LOG_LEVEL,
+    format='%(message)s',  # the listener's handlers add the timestamp and level
+    handlers=[logging.handlers.QueueHandler(log_queue)],
     force=True  # This ensures our configuration takes precedence
 )
+log_listener.start()
+# Flush queued records on exit
+atexit.register(log_listener.stop)
 
 # Create a logger for this module
 logger = logging.getLogger(__name__)
@@ -33,7 +54,7 @@ logger = logging.getLogger(__name__)
 # Also log third-party libraries we care about
 logging.getLogger('uvicorn').setLevel(logging.INFO)
 logging.getLogger('fastapi').setLevel(logging.INFO)
-logging.getLogger('telegram').setLevel(logging.DEBUG)
+logging.getLogger('telegram').setLevel(LOG_LEVEL)
 logging.getLogger('openai').setLevel(logging.INFO)
 
 # Load environment variables
@@ -41,23 +62,47 @@ load_dotenv()
 MOCK_MODE = str(os.getenv("MOCK_MODE", "false")).lower() in ("true", "1", "yes")
 
 # Initialize OpenAI client
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+client = get_openai_client()
 
-# Initialize FastAPI
-app = FastAPI(
-    title="Telegram Bot API",
-    description="FastAPI application for Telegram bot with memory capabilities",
-    version="1.0.0"
-)
+# Caps concurrent completions so bursts of updates stay under OpenAI's rate limits
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Serialized once: the webhook answers every successful update with the same body.
+# Only the bytes are shared; FastAPI mutates the Response objects it returns
+OK_BODY = b'{"status":"ok"}'
+BUSY_BODY = b'{"error":"busy"}'
+
+# Strong references to the long-running background loops so they are not
+# garbage-collected mid-flight and can be cancelled on shutdown
+background_tasks = set()
+
+# Updates still being processed after their webhook call returned; awaited on shutdown
+webhook_tasks = set()
+
+def background_task_done(task: asyncio.Task):
+    """Forget a finished background loop and log why it stopped, if it crashed"""
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} stopped", exc_info=task.exception())
 
-# Add startup event handler
-@app.on_event("startup")
 async def startup_event():
     try:
         logger.info("Starting application initialization...")
+        # Python 3.12+: tasks that finish without suspending (cache hits, quick commands)
+        # run inline instead of waiting for a turn of the event loop
+        loop = asyncio.get_running_loop()
+        if hasattr(asyncio, "eager_task_factory"):
+            loop.set_task_factory(asyncio.eager_task_factory)
+        # One explicitly sized pool behind every asyncio.to_thread call (file writes, history parsing)
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking"))
+        
         # Initialize memory files
         logger.info("Initializing memory files...")
         init_memory_files()
+        # Memory file saves go through a background writer from here on
+        get_file_writer().start()
+        # tiktoken downloads its BPE file on first use; do that here, not inside the first chat request
+        await asyncio.to_thread(get_encoding)
         
         # Initialize application
         logger.info("Running application initialization...")
@@ -66,8 +111,10 @@ async def startup_event():
         # Start background tasks only if initialization successful
         if is_initialized:
             logger.info("Starting background tasks...")
-            asyncio.create_task(update_history_context())
-            asyncio.create_task(periodic_history_analysis())
+            for coro in (update_history_context(), periodic_history_analysis()):
+                task = asyncio.create_task(coro, name=coro.__name__)
+                background_tasks.add(task)
+                task.add_done_callback(background_task_done)
             logger.info("Background tasks started")
         
         logger.info("Application startup complete")
@@ -75,23 +122,55 @@ async def startup_event():
         logger.error(f"Error during startup: {e}", exc_info=True)
         raise
 
-# Add shutdown event handler
-@app.on_event("shutdown")
 async def shutdown_event():
     try:
         logger.info("Starting application shutdown...")
+        for task in list(background_tasks):
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        # Let updates that were already acknowledged finish
+        await asyncio.gather(*webhook_tasks, return_exceptions=True)
         if application.running:
             await application.stop()
+        memory_manager.flush()
+        await get_file_writer().stop()
+        # Close the pooled OpenAI connections instead of leaving them to the garbage collector
+        await client.close()
         logger.info("Application shutdown complete")
     except Exception as e:
         logger.error(f"Error during shutdown: {e}", exc_info=True)
         raise
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the bot with the server and shut it down cleanly when the server stops"""
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
+# Initialize FastAPI
+app = FastAPI(
+    title="Telegram Bot API",
+    description="FastAPI application for Telegram bot with memory capabilities",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
 # Initialize Memory Manager
-memory_manager = MemoryManager()
+memory_manager = get_memory_manager()
+
+# Embeddings of past turns, searched for memories relevant to each message
+memory_index = get_memory_index()
+
+# Cache of assistant responses keyed on prompt + history context
+response_cache = ResponseCache()
+
+# Longest command reply we send; Telegram rejects messages over 4096 characters
+MAX_REPLY_LENGTH = 4000
 
 # Add these variables after imports
-DEFAULT_SESSION = 6 * 3600  # 6 hours
 session_durations = {
     "short": 3 * 3600,  # 3 hours
     "medium": 6 * 3600,  # 6 hours
@@ -101,179 +180,192 @@ session_durations = {
 # Add after other constants
 logger.info(f"MOCK_MODE is set to: {MOCK_MODE}")
 
+# Kept free of per-request data so OpenAI can reuse the cached prompt prefix
+SYSTEM_PROMPT = """You are a helpful AI assistant with memory capabilities.
+
+Guidelines:
+- Remember and use people's names and preferences
+- Always respond in the same language as the user's message
+- Keep track of important information shared in conversation
+- If you learn someone's name, use it in future responses
+- Be friendly and personable while maintaining professionalism"""
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+@lru_cache(maxsize=1)
+def history_context_message(history_summary: str) -> dict:
+    """The history-context block, rebuilt only when the summary changes"""
+    return {
+        "role": "system",
+        "content": f"Important context about our conversation history:\n{history_summary}"
+    }
+
+@lru_cache(maxsize=1)
+def response_cache_scope(history_summary: str) -> str:
+    return ResponseCache.scope_for(CHAT_MODEL, SYSTEM_PROMPT, history_summary)
+
+@lru_cache(maxsize=1)
+def prefix_tokens(history_summary: str) -> int:
+    """Tokens of the system prompt and history context, recounted only when the summary changes"""
+    return count_tokens(SYSTEM_PROMPT) + count_tokens(history_summary)
+
+def memories_message(memories: list) -> dict:
+    """Past turns retrieved for the current message, placed right after the stable prompt prefix"""
+    content = "\n\n".join(f"User: {m['user']}\nAssistant: {m['assistant']}" for m in memories)
+    return {"role": "system", "content": f"Relevant past memories:\n{content}"}
+
+# Command descriptions, shared by /help and the menu registered with Telegram
+COMMAND_DESCRIPTIONS = [
+    ("start", "Start the bot"),
+    ("help", "Show available commands"),
+    ("clear", "Clear conversation history"),
+    ("session", "Set session duration"),
+    ("analyze", "Analyze conversation history"),
+    ("context", "Show historical context"),
+    ("midterm", "Show mid-term memory stats"),
+    ("shortterm", "Show short-term memory stats"),
+    ("wholehistory", "Show whole history stats"),
+    ("historycontext", "Show full history context")
+]
+BOT_COMMANDS = [BotCommand(command, description) for command, description in COMMAND_DESCRIPTIONS]
+
+START_TEXT = (
+    "👋 Hello! I'm your AI assistant bot. I can help you with various tasks and maintain our conversation history.\n\n"
+    "Use /help to see available commands."
+)
+HELP_TEXT = "Here are the available commands:\n\n" + "\n".join(
+    f"/{command} - {description}" for command, description in COMMAND_DESCRIPTIONS
+)
+
+def reply_on_error(error_text: str):
+    """Log any exception raised by a command handler and answer with error_text instead"""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            try:
+                return await handler(update, context)
+            except Exception as e:
+                logger.error(f"Error in {handler.__name__}: {e}", exc_info=True)
+                await update.message.reply_text(error_text)
+        return wrapper
+    return decorator
+
 # Move all command handlers to the top, before application initialization
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "👋 Hello! I'm your AI assistant bot. I can help you with various tasks and maintain our conversation history.\n\n"
-        "Use /help to see available commands."
-    )
+    await update.message.reply_text(START_TEXT)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "Here are the available commands:\n\n"
-        "/start - Start the bot\n"
-        "/help - Show this help message\n"
-        "/clear - Clear conversation history\n"
-        "/session - Set session duration\n"
-        "/analyze - Analyze conversation history\n"
-        "/context - Show historical context\n"
-        "/midterm - Show mid-term memory stats\n"
-        "/shortterm - Show short-term memory stats\n"
-        "/wholehistory - Show whole history stats\n"
-        "/historycontext - Show full history context"
-    )
+    await update.message.reply_text(HELP_TEXT)
 
+@reply_on_error("Error clearing conversation history")
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        # Clear short-term memory
-        memory_manager._save_memory(SHORT_TERM_FILE, [])
-        await update.message.reply_text("Conversation history has been cleared! 🧹")
-    except Exception as e:
-        logger.error(f"Error in clear_command: {e}", exc_info=True)
-        await update.message.reply_text("Error clearing conversation history")
+    # Clear short-term memory
+    memory_manager.clear_short_term()
+    await update.message.reply_text("Conversation history has been cleared! 🧹")
 
+@reply_on_error("Error setting session duration")
 async def set_session_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        duration = context.args[0].lower() if context.args else "medium"
-        if duration in session_durations:
-            global SESSION_DURATION
-            SESSION_DURATION = session_durations[duration]
-            await update.message.reply_text(
-                f"Session duration set to {duration} ({SESSION_DURATION//3600} hours)"
-            )
-        else:
-            await update.message.reply_text(
-                "Invalid duration. Use: short (3h), medium (6h), or long (12h)"
-            )
-    except Exception as e:
-        logger.error(f"Error in set_session_command: {e}", exc_info=True)
-        await update.message.reply_text("Error setting session duration")
+    duration = context.args[0].lower() if context.args else "medium"
+    if duration in session_durations:
+        memory_manager.set_session_duration(session_durations[duration])
+        await update.message.reply_text(
+            f"Session duration set to {duration} ({runtime_config.session_duration//3600} hours)"
+        )
+    else:
+        await update.message.reply_text(
+            "Invalid duration. Use: short (3h), medium (6h), or long (12h)"
+        )
 
+@reply_on_error("Error analyzing history")
 async def analyze_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
+    if MEMORY_RETRIEVAL_ENABLED:
+        # Independent jobs: summarize new messages and index turns missing from retrieval
+        await asyncio.gather(analyze_whole_history(), backfill_memory_index())
+    else:
         await analyze_whole_history()
-        await update.message.reply_text("History analysis completed! The context has been updated.")
-    except Exception as e:
-        logger.error(f"Error in analyze_history_command: {e}", exc_info=True)
-        await update.message.reply_text("Error analyzing history")
+    await update.message.reply_text("History analysis completed! The context has been updated.")
 
+@reply_on_error("Error retrieving historical context")
 async def show_context_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open(HISTORY_CONTEXT_FILE, 'r') as f:
-            history_context = json.load(f)
-        
-        if not history_context:
-            await update.message.reply_text("No historical context available yet.")
-            return
-            
-        context_text = "📚 Historical Context:\n\n"
-        for entry in history_context:
-            context_text += f"🕒 {entry['timestamp'][:16]}\n"
-            context_text += f"{entry['summary']}\n\n"
-            
-        await update.message.reply_text(context_text)
-    except Exception as e:
-        logger.error(f"Error showing context: {e}", exc_info=True)
-        await update.message.reply_text("Error retrieving historical context")
-
-async def mid_term_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open('memory/mid_term.json', 'r') as f:
-            mid_term = json.load(f)
-        
-        stats = {
-            "total_messages": len(mid_term),
-            "user_messages": len([m for m in mid_term if m.get("role") == "user"]),
-            "assistant_messages": len([m for m in mid_term if m.get("role") == "assistant"]),
-            "time_range": f"{mid_term[0]['timestamp']} - {mid_term[-1]['timestamp']}" if mid_term else "No messages"
-        }
-        
-        response = "📊 Mid-term Memory Stats:\n\n"
-        response += f"Total messages: {stats['total_messages']}\n"
-        response += f"User messages: {stats['user_messages']}\n"
-        response += f"Assistant messages: {stats['assistant_messages']}\n"
-        response += f"Time range: {stats['time_range']}"
-        
-        await update.message.reply_text(response)
-    except Exception as e:
-        logger.error(f"Error in mid_term_history_command: {e}", exc_info=True)
-        await update.message.reply_text("Error retrieving mid-term history stats")
-
-async def short_term_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open('memory/short_term.json', 'r') as f:
-            short_term = json.load(f)
-        
-        stats = {
-            "total_messages": len(short_term),
-            "user_messages": len([m for m in short_term if m.get("role") == "user"]),
-            "assistant_messages": len([m for m in short_term if m.get("role") == "assistant"]),
-            "time_range": f"{short_term[0]['timestamp']} - {short_term[-1]['timestamp']}" if short_term else "No messages"
-        }
-        
-        response = "📊 Short-term Memory Stats:\n\n"
-        response += f"Total messages: {stats['total_messages']}\n"
-        response += f"User messages: {stats['user_messages']}\n"
-        response += f"Assistant messages: {stats['assistant_messages']}\n"
-        response += f"Time range: {stats['time_range']}"
-        
-        await update.message.reply_text(response)
-    except Exception as e:
-        logger.error(f"Error in short_term_history_command: {e}", exc_info=True)
-        await update.message.reply_text("Error retrieving short-term history stats")
+    history_context = memory_manager.get_history_context()
+    
+    if not history_context:
+        await update.message.reply_text("No historical context available yet.")
+        return
+        
+    parts = ["📚 Historical Context:\n\n"]
+    length = len(parts[0])
+    for entry in history_context:
+        part = f"🕒 {entry['timestamp'][:16]}\n{entry['summary']}\n\n"
+        parts.append(part)
+        length += len(part)
+        # The rest would be cut off anyway
+        if length > MAX_REPLY_LENGTH:
+            break
+    context_text = "".join(parts)
+    
+    if len(context_text) > MAX_REPLY_LENGTH:
+        context_text = context_text[:MAX_REPLY_LENGTH - 3] + "..."
+        
+    await update.message.reply_text(context_text)
+
+def make_stats_command(tier: str, title: str, error_text: str):
+    """Build the handler of a stats command; the counters come from memory_manager, no file is read"""
+    async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        stats = memory_manager.get_stats(tier)
+        await update.message.reply_text(
+            f"📊 {title} Stats:\n\n"
+            f"Total messages: {stats['total_messages']}\n"
+            f"User messages: {stats['user_messages']}\n"
+            f"Assistant messages: {stats['assistant_messages']}\n"
+            f"Time range: {stats['time_range']}"
+        )
+    # Tells the tiers apart in the error log
+    stats_command.__name__ = f"{tier}_stats_command"
+    return reply_on_error(error_text)(stats_command)
 
-async def whole_history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open('memory/whole_history.json', 'r') as f:
-            whole_history = json.load(f)
-        
-        stats = {
-            "total_messages": len(whole_history),
-            "user_messages": len([m for m in whole_history if m.get("role") == "user"]),
-            "assistant_messages": len([m for m in whole_history if m.get("role") == "assistant"]),
-            "time_range": f"{whole_history[0]['timestamp']} - {whole_history[-1]['timestamp']}" if whole_history else "No messages"
-        }
-        
-        response = "📊 Whole History Stats:\n\n"
-        response += f"Total messages: {stats['total_messages']}\n"
-        response += f"User messages: {stats['user_messages']}\n"
-        response += f"Assistant messages: {stats['assistant_messages']}\n"
-        response += f"Time range: {stats['time_range']}"
-        
-        await update.message.reply_text(response)
-    except Exception as e:
-        logger.error(f"Error in whole_history_command: {e}", exc_info=True)
-        await update.message.reply_text("Error retrieving whole history stats")
+mid_term_history_command = make_stats_command("mid", "Mid-term Memory", "Error retrieving mid-term history stats")
+short_term_history_command = make_stats_command("short", "Short-term Memory", "Error retrieving short-term history stats")
+whole_history_command = make_stats_command("whole", "Whole History", "Error retrieving whole history stats")
 
+@reply_on_error("Error retrieving history context")
 async def history_context_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        with open('memory/history_context.json', 'r') as f:
-            history_context = json.load(f)
+    history_context = memory_manager.get_history_context()
+    
+    if not history_context:
+        await update.message.reply_text("No history context available")
+        return
+        
+    parts = ["📝 History Context:\n\n"]
+    length = len(parts[0])
+    for entry in history_context:
+        part = (
+            f"🕒 {entry['timestamp']}\n"
+            f"Type: {entry['type']}\n"
+            f"Messages: {entry.get('message_count', 'N/A')}\n"
+            f"Summary:\n{entry['summary']}\n\n"
+        )
+        parts.append(part)
+        length += len(part)
+        # The rest would be cut off anyway
+        if length > MAX_REPLY_LENGTH:
+            break
+    response = "".join(parts)
         
-        if not history_context:
-            await update.message.reply_text("No history context available")
-            return
-            
-        response = "📝 History Context:\n\n"
-        for entry in history_context:
-            response += f"🕒 {entry['timestamp']}\n"
-            response += f"Type: {entry['type']}\n"
-            response += f"Messages: {entry.get('message_count', 'N/A')}\n"
-            response += f"Summary:\n{entry['summary']}\n\n"
-            
-        if len(response) > 4000:
-            response = response[:3997] + "..."
-            
-        await update.message.reply_text(response)
-    except Exception as e:
-        logger.error(f"Error in history_context_command: {e}", exc_info=True)
-        await update.message.reply_text("Error retrieving history context")
+    if len(response) > MAX_REPLY_LENGTH:
+        response = response[:MAX_REPLY_LENGTH - 3] + "..."
+        
+    await update.message.reply_text(response)
 
 # Initialize Telegram application
 logger.info("Initializing Telegram application...")
 application = (ApplicationBuilder()
               .token(TELEGRAM_TOKEN)
               .concurrent_updates(True)
+              # PTB keeps its own pooled httpx client; HTTP/2 lets concurrent replies share one connection
+              .http_version("2")
+              # Queues outgoing calls within Telegram's per-chat and overall flood limits,
+              # and retries calls rejected with RetryAfter instead of failing the reply
+              .rate_limiter(AIORateLimiter(max_retries=3))
               .build())
 
 # Track application state
@@ -281,103 +373,217 @@ is_initialized = False
 
 # Message handler
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_input = update.message.text
+    chat_id = update.message.chat_id
+    logger.info("Message handler called for chat %s", chat_id)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Input from %s: %s", update.message.from_user.username, user_input)
+
     try:
-        user_input = update.message.text
-        logger.info(f"Message handler called with input: {user_input}")
-        logger.info(f"Chat ID: {update.message.chat_id}")
-        logger.info(f"From user: {update.message.from_user.username}")
-        
-        logger.info("Getting chat response from OpenAI...")
-        response = await get_chat_response(user_input)
-        logger.info(f"Got OpenAI response: {response}")
-        
-        logger.info("Attempting to send message back to user...")
-        await context.bot.send_message(
-            chat_id=update.message.chat_id,
-            text=response
+        logger.debug("Streaming chat response from OpenAI...")
+        # Show "typing..." while the model works instead of before it starts
+        typing = asyncio.create_task(
+            context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
         )
+        loop = asyncio.get_running_loop()
+        parts = []
+        sent = None
+        sent_text = ""
+        offset = 0  # where the text of the current message starts in the reply
+        last_edit = 0.0
+
+        async def show(text: str):
+            # Fill messages up to MAX_REPLY_LENGTH, continuing long replies in a new message
+            nonlocal sent, sent_text, offset
+            while len(text) > MAX_REPLY_LENGTH:
+                head = text[:MAX_REPLY_LENGTH]
+                if sent is None:
+                    await context.bot.send_message(chat_id=chat_id, text=head)
+                elif head != sent_text:
+                    await sent.edit_text(head)
+                sent, sent_text = None, ""
+                offset += MAX_REPLY_LENGTH
+                text = text[MAX_REPLY_LENGTH:]
+            if sent is None:
+                sent = await context.bot.send_message(chat_id=chat_id, text=text)
+            elif text != sent_text:
+                await sent.edit_text(text)
+            sent_text = text
+
+        # aclosing: if sending fails mid-reply, the OpenAI stream is closed right away, not when collected
+        async with aclosing(stream_chat_response(user_input)) as deltas:
+            async for delta in deltas:
+                parts.append(delta)
+                # The first chunk creates the reply; later chunks edit it, at most
+                # once per STREAM_EDIT_INTERVAL to stay inside Telegram's rate limits
+                if sent is None or loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+                    await show("".join(parts)[offset:])
+                    last_edit = loop.time()
+
+        await asyncio.gather(typing, return_exceptions=True)
+
+        response = "".join(parts)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Got OpenAI response: %s", response)
+        if response[offset:]:
+            await show(response[offset:])
         logger.info("Message sent successfully")
     except Exception as e:
         logger.error(f"Error in message handler: {e}", exc_info=True)
         try:
             await context.bot.send_message(
-                chat_id=update.message.chat_id,
+                chat_id=chat_id,
                 text="An error occurred while processing your message."
             )
         except Exception as send_error:
             logger.error(f"Failed to send error message: {send_error}", exc_info=True)
 
 async def get_chat_response(user_input: str) -> str:
+    async with aclosing(stream_chat_response(user_input)) as deltas:
+        return "".join([delta async for delta in deltas])
+
+async def stream_chat_response(user_input: str) -> AsyncIterator[str]:
+    """Yield the assistant reply in chunks as OpenAI streams it.
+
+    Memory is updated once the stream is exhausted, so callers must consume it fully.
+    """
+    streamed = False
     try:
-        logger.info("Starting get_chat_response...")
-        # Get context from memory
-        logger.info("Getting context from memory manager...")
-        short_term, history_context = memory_manager.get_context()
-        logger.info(f"Got short_term context with {len(short_term) if short_term else 0} messages")
-        logger.info(f"Got history context with {len(history_context) if history_context else 0} entries")
+        # Per-turn diagnostics; the history context length costs a stat() of its file
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Got short_term context with %d messages", len(memory_manager.short_term))
+            logger.debug("Got history context with %d entries", len(memory_manager.get_history_context()))
         
         # Format history context
-        history_summary = "\n".join([fact["summary"] for fact in history_context]) if history_context else ""
-        
-        # Start with system message
-        messages = [
-            {"role": "system", "content": f"""You are a helpful AI assistant with memory capabilities.
-                Important context about our conversation history:
-                {history_summary}
-                
-                Guidelines:
-                - Remember and use people's names and preferences
-                - Always respond in the same language as the user's message
-                - Keep track of important information shared in conversation
-                - If you learn someone's name, use it in future responses
-                - Be friendly and personable while maintaining professionalism"""}
-        ]
-        
-        # Add short-term memory - ensure proper string format
-        if short_term:
-            logger.info("Adding short-term memory to messages...")
-            for msg in short_term:
-                if isinstance(msg, dict):
-                    # Extract string content from dict
-                    content = msg.get("content")
-                    if isinstance(content, dict):
-                        content = content.get("content", "")
-                    messages.append({"role": msg.get("role", "user"), "content": str(content)})
-                else:
-                    # Handle string messages
-                    messages.append({"role": "user", "content": str(msg)})
-        
-        # Add current message
-        messages.append({"role": "user", "content": user_input})
+        history_summary = memory_manager.get_history_summary()
         
         if MOCK_MODE:
             logger.info("Mock mode enabled, returning mock response")
-            return f"Mock response to: {user_input}"
+            yield f"Mock response to: {user_input}"
+            return
             
-        # Get response from OpenAI
-        logger.info("Calling OpenAI API...")
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
-        logger.info("Got response from OpenAI")
-        
-        assistant_response = response.choices[0].message.content
+        # Serve repeated or near-identical prompts from the response cache, keyed on the
+        # turns the prompt replays (retrieved memories are left out, or nothing would ever hit)
+        cache_scope = response_cache_scope(history_summary)
+        cache_state = memory_manager.recent_turns_state
+        cache_key = ResponseCache.make_key(cache_scope, cache_state, user_input)
+        # Near-identical prompts only match within the same conversation state, so a short
+        # follow-up is never answered with a reply given earlier in another conversation
+        semantic_scope = ResponseCache.state_scope(cache_scope, cache_state)
+        query_embedding = None
+        assistant_response = response_cache.get(cache_key)
+        if assistant_response is None and (SEMANTIC_CACHE_ENABLED or MEMORY_RETRIEVAL_ENABLED):
+            try:
+                query_embedding = await embed_text(user_input)
+            except Exception as e:
+                logger.warning(f"Embedding user input failed: {e}")
+        if assistant_response is None and SEMANTIC_CACHE_ENABLED and query_embedding is not None:
+            assistant_response = response_cache.get_similar(semantic_scope, query_embedding)
+        
+        if assistant_response is not None:
+            logger.info("Response cache hit, skipping OpenAI call")
+            streamed = True
+            yield assistant_response
+        else:
+            # Start with the static system message so the prompt prefix stays cacheable,
+            # then the history context, which changes only when it is re-summarized
+            messages = [SYSTEM_MESSAGE]
+            if history_summary:
+                messages.append(history_context_message(history_summary))
+
+            # Replay only the last MAX_CONTEXT_TURNS turns (user + assistant message each)
+            window = memory_manager.short_term[-MAX_CONTEXT_TURNS * 2:]
+            fixed_tokens = prefix_tokens(history_summary) + count_tokens(user_input)
+
+            # Past turns similar to the message, other than the ones replayed below
+            if MEMORY_RETRIEVAL_ENABLED and query_embedding is not None:
+                memories = memory_index.search(
+                    query_embedding,
+                    MEMORY_RETRIEVAL_TOP_K,
+                    before=window[0]["timestamp"] if window else None
+                )
+                if memories:
+                    logger.debug("Retrieved %d relevant memories", len(memories))
+                    memory_message = memories_message(memories)
+                    messages.append(memory_message)
+                    fixed_tokens += count_tokens(memory_message["content"])
+
+            # Whatever the fixed part of the prompt leaves of the token budget goes to the most recent
+            # turns; stored messages carry their token counts, so this only sums integers
+            window = trim_to_token_budget(
+                window,
+                [message_tokens(msg) for msg in window],
+                MAX_CONTEXT_TOKENS - fixed_tokens
+            )
+
+            # Add short-term memory; stored content is already a plain string
+            messages.extend({"role": msg["role"], "content": msg["content"]} for msg in window)
+            
+            # Add current message
+            messages.append({"role": "user", "content": user_input})
+
+            # Stream the response from OpenAI
+            logger.debug("Calling OpenAI API...")
+            # The stream is read by its own task, so the OpenAI slot is freed once the reply is
+            # in rather than held while the caller waits on (rate limited) Telegram calls
+            chunks: asyncio.Queue = asyncio.Queue()
+
+            async def read_stream():
+                try:
+                    async with openai_semaphore:
+                        stream = await client.chat.completions.create(
+                            model=CHAT_MODEL,
+                            messages=messages,
+                            stream=True
+                        )
+                        async with stream:
+                            async for chunk in stream:
+                                if not chunk.choices:
+                                    continue
+                                delta = chunk.choices[0].delta.content
+                                if delta:
+                                    chunks.put_nowait(delta)
+                finally:
+                    chunks.put_nowait(None)
+
+            reader = asyncio.create_task(read_stream())
+            parts = []
+            try:
+                while (delta := await chunks.get()) is not None:
+                    parts.append(delta)
+                    streamed = True
+                    yield delta
+                # Raises whatever ended the stream early
+                await reader
+            finally:
+                # Closing this generator early closes the stream too
+                reader.cancel()
+            logger.debug("Got response from OpenAI")
+            
+            assistant_response = "".join(parts)
+            response_cache.put(cache_key, assistant_response, semantic_scope, query_embedding)
         
         # Store messages as proper format
-        logger.info("Updating memory with new messages...")
-        memory_manager.update_memory(
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": assistant_response}
-        )
-        logger.info("Memory updated successfully")
-        
-        return assistant_response
+        logger.debug("Updating memory with new messages...")
+        memory_manager.update_memory(user_input, assistant_response)
+        logger.debug("Memory updated successfully")
+
+        # Index the turn under the embedding of its user message for later retrieval
+        if MEMORY_RETRIEVAL_ENABLED and query_embedding is not None:
+            try:
+                memory_index.add(query_embedding, [{
+                    "user": user_input,
+                    "assistant": assistant_response,
+                    "timestamp": memory_manager.short_term[-1]["timestamp"]
+                }])
+            except Exception as e:
+                logger.warning(f"Indexing turn for retrieval failed: {e}")
         
     except Exception as e:
         logger.error(f"Chat response error: {e}", exc_info=True)
-        return "I apologize, but I encountered an error. Please try again."
+        # Don't append an apology to a reply the user has already partly seen
+        if not streamed:
+            yield "I apologize, but I encountered an error. Please try again."
 
 # Test endpoint for OpenAI
 @app.get("/test_openai")
@@ -412,10 +618,10 @@ async def init_application():
             
         logger.info("Initializing application...")
         await application.initialize()
-        logger.info("Starting application...")
-        await application.start()
-        logger.info("Setting up commands...")
-        await setup_commands()
+        # Starting the update processor and registering commands with Telegram
+        # are independent once the bot is initialized, so overlap them
+        logger.info("Starting application and setting up commands...")
+        await asyncio.gather(application.start(), setup_commands())
         
         is_initialized = True
         logger.info("Application fully initialized and started")
@@ -427,37 +633,37 @@ async def init_application():
 async def setup_commands():
     try:
         logger.info("Setting up bot commands...")
-        commands = [
-            BotCommand("start", "Start the bot"),
-            BotCommand("help", "Show available commands"),
-            BotCommand("clear", "Clear conversation history"),
-            BotCommand("session", "Set session duration"),
-            BotCommand("analyze", "Analyze conversation history"),
-            BotCommand("context", "Show historical context"),
-            BotCommand("midterm", "Show mid-term memory stats"),
-            BotCommand("shortterm", "Show short-term memory stats"),
-            BotCommand("wholehistory", "Show whole history stats"),
-            BotCommand("historycontext", "Show full history context")
-        ]
-        await application.bot.set_my_commands(commands)
+        await application.bot.set_my_commands(BOT_COMMANDS)
         logger.info("Bot commands set up successfully")
     except Exception as e:
         logger.error(f"Error setting up commands: {e}", exc_info=True)
         raise
 
+# Slash command -> handler
+COMMANDS = {
+    "start": start_command,
+    "help": help_command,
+    "clear": clear_command,
+    "session": set_session_command,
+    "analyze": analyze_history_command,
+    "context": show_context_command,
+    "midterm": mid_term_history_command,
+    "shortterm": short_term_history_command,
+    "wholehistory": whole_history_command,
+    "historycontext": history_context_command
+}
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route a command to its handler with one dict lookup"""
+    # "/cmd@BotName args" -> "cmd"
+    command = update.effective_message.text[1:].split(maxsplit=1)[0].split("@")[0].lower()
+    await COMMANDS[command](update, context)
+
 # Add handlers after all functions are defined
 logger.info("Adding handlers...")
 try:
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("clear", clear_command))
-    application.add_handler(CommandHandler("session", set_session_command))
-    application.add_handler(CommandHandler("analyze", analyze_history_command))
-    application.add_handler(CommandHandler("context", show_context_command))
-    application.add_handler(CommandHandler("midterm", mid_term_history_command))
-    application.add_handler(CommandHandler("shortterm", short_term_history_command))
-    application.add_handler(CommandHandler("wholehistory", whole_history_command))
-    application.add_handler(CommandHandler("historycontext", history_context_command))
+    # One handler for all commands instead of one per command, each checked in turn
+    application.add_handler(CommandHandler(list(COMMANDS), dispatch_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
     logger.info("Handlers added successfully")
 except Exception as e:
@@ -465,27 +671,55 @@ except Exception as e:
     raise
 
 # Add back the webhook handler
-@app.post("/{token:path}")
-async def telegram_webhook(token: str, request: Request):
+async def process_update_safely(update: Update):
+    """Run an update through the application in the background, reporting failures to the chat"""
     try:
-        logger.info("Webhook called - starting update processing")
+        await application.process_update(update)
+        logger.debug("Update processed successfully")
+    except Exception as process_error:
+        logger.error(f"Error processing update: {process_error}", exc_info=True)
+        # Try to send error message directly
+        try:
+            if update.message:
+                await application.bot.send_message(
+                    chat_id=update.message.chat_id,
+                    text="Sorry, I encountered an error processing your message."
+                )
+        except Exception as send_error:
+            logger.error(f"Failed to send error message: {send_error}", exc_info=True)
+
+# The token is part of the route itself, so requests to any other path are rejected by the router
+@app.post(f"/{TELEGRAM_TOKEN}")
+async def telegram_webhook(request: Request):
+    try:
+        logger.debug("Webhook called - starting update processing")
+        
+        # Telegram echoes the secret_token given to setWebhook in this header
+        if WEBHOOK_SECRET and not hmac.compare_digest(
+            request.headers.get("x-telegram-bot-api-secret-token", ""), WEBHOOK_SECRET
+        ):
+            logger.warning("Rejected webhook call with an invalid secret token")
+            return {"error": "Invalid token"}
         
         if not is_initialized:
             logger.error("Application not initialized yet")
             return {"error": "Application still initializing"}
-        
-        # Verify token
-        if token != TELEGRAM_TOKEN:
-            logger.error(f"Invalid token: {token}")
-            return {"error": "Invalid token"}
+
+        # Updates are processed after the request returns, so uvicorn's limit doesn't cover
+        # them; past the cap, a 503 makes Telegram redeliver the update later instead
+        if len(webhook_tasks) >= HTTP_MAX_CONCURRENCY:
+            logger.warning("%d updates in flight, asking Telegram to retry later", len(webhook_tasks))
+            return Response(BUSY_BODY, status_code=503, media_type="application/json")
             
-        body = await request.json()
-        logger.info(f"Received webhook body: {body}")
+        # Starlette's request.json() decodes with the stdlib parser
+        body = orjson.loads(await request.body())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received webhook body: %s", body)
         
         # Create update object and process it
-        logger.info("Creating Update object...")
         update = Update.de_json(body, application.bot)
-        logger.info(f"Update object created successfully: {update}")
+        if update:
+            logger.info("Received update %s", update.update_id)
         
         if not update:
             logger.error("Failed to create Update object")
@@ -495,25 +729,13 @@ async def telegram_webhook(token: str, request: Request):
             logger.error("Bot not initialized")
             return {"error": "Bot not initialized"}
             
-        logger.info("Processing update through application...")
-        try:
-            logger.info("Calling process_update...")
-            await application.process_update(update)
-            logger.info("Update processed successfully")
-        except Exception as process_error:
-            logger.error(f"Error processing update: {process_error}", exc_info=True)
-            # Try to send error message directly
-            try:
-                if update.message:
-                    await application.bot.send_message(
-                        chat_id=update.message.chat_id,
-                        text="Sorry, I encountered an error processing your message."
-                    )
-            except Exception as send_error:
-                logger.error(f"Failed to send error message: {send_error}", exc_info=True)
-            raise
+        # Acknowledge right away; Telegram redelivers updates whose webhook call is slow
+        logger.debug("Processing update through application...")
+        task = asyncio.create_task(process_update_safely(update))
+        webhook_tasks.add(task)
+        task.add_done_callback(webhook_tasks.discard)
         
-        return {"status": "ok"}
+        return Response(OK_BODY, media_type="application/json")
         
     except Exception as e:
         logger.error(f"Webhook error: {e}", exc_info=True)
@@ -521,9 +743,6 @@ async def telegram_webhook(token: str, request: Request):
 
 # Update the main section
 if __name__ == "__main__":
-    import uvicorn
-    import asyncio
-    
     # Get port from environment variable with fallback to 8000
     port = int(os.getenv("PORT", "8000"))
     
@@ -546,5 +765,10 @@ if __name__ == "__main__":
         port=port,
         log_level="info",
         log_config=log_config,
-        access_log=True
+        access_log=True,
+        # Shed load with 503s instead of queueing unbounded work behind the OpenAI semaphore
+        limit_concurrency=HTTP_MAX_CONCURRENCY,
+        # uvloop and httptools when installed (uvloop is not available on Windows), asyncio and h11 otherwise
+        loop="auto",
+        http="auto"
     )
\ No newline at end of file
@@ -1,41 +1,82 @@
 import os
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Debug ALL environment variables
-all_vars = dict(os.environ)
-print("ALL Environment Variables (sanitized):")
-for key, value in all_vars.items():
-    # Only show first/last 4 chars of sensitive values
-    if key in ['TELEGRAM_TOKEN', 'OPENAI_API_KEY']:
-        print(f"{key}: {value[:4]}...{value[-4:]}")
-    else:
-        print(f"{key}: {value}")
-
-# Debug environment
-print("All environment variables:", list(os.environ.keys()))
-print("TELEGRAM_TOKEN value:", os.getenv("TELEGRAM_TOKEN"))
-print("OPENAI_API_KEY value:", os.getenv("OPENAI_API_KEY"))
-
 # Bot Configuration
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
-    print("WARNING: TELEGRAM_TOKEN not found. Available vars:", os.environ)
     raise ValueError("TELEGRAM_TOKEN not found in environment variables")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY not found in environment variables")
 
+# Optional secret_token passed to setWebhook; when set, webhook calls without it are rejected
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Logging Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Chat Configuration
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))  # seconds between Telegram message edits
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 32))  # in-flight chat completions per process
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", 256))  # open HTTP connections, and updates in flight, before answering 503
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30.0))  # seconds per OpenAI read/write
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", 8))  # threads for file I/O and parsing moved off the event loop
+MAX_CONTEXT_TURNS = int(os.getenv("MAX_CONTEXT_TURNS", 20))  # user+assistant pairs replayed from short-term memory
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", 6000))  # prompt budget, oldest turns are dropped first
+
 # Memory Configuration
-SESSION_DURATION = 6 * 3600  # 6 hours (default)
+SESSION_DURATION = int(os.getenv("SESSION_DURATION", 6 * 3600))  # 6 hours (default)
 MID_TERM_MESSAGE_LIMIT = 200
+SHORT_TERM_MESSAGE_LIMIT = int(os.getenv("SHORT_TERM_MESSAGE_LIMIT", 200))  # older messages move to mid-term early
+SHORT_TERM_SAVE_INTERVAL = int(os.getenv("SHORT_TERM_SAVE_INTERVAL", 5))  # turns between short-term saves
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+PRETTY_JSON = os.getenv("PRETTY_JSON", "false").lower() in ("true", "1", "yes")  # indent memory files for debugging
+
+@dataclass
+class RuntimeConfig:
+    """Settings that can be changed while the bot runs, e.g. by /session.
+
+    Readers look the attribute up each time instead of importing the value, so a
+    change is seen everywhere; attribute assignment is atomic.
+    """
+    session_duration: int = SESSION_DURATION
+
+runtime_config = RuntimeConfig()
 
 # File Paths
 MEMORY_DIR = "memory"
 SHORT_TERM_FILE = os.path.join(MEMORY_DIR, "short_term.json")
 MID_TERM_FILE = os.path.join(MEMORY_DIR, "mid_term.json")
-WHOLE_HISTORY_FILE = os.path.join(MEMORY_DIR, "whole_history.json")
-HISTORY_CONTEXT_FILE = os.path.join(MEMORY_DIR, "history_context.json") 
\ No newline at end of file
+WHOLE_HISTORY_FILE = os.path.join(MEMORY_DIR, "whole_history.jsonl")
+LEGACY_WHOLE_HISTORY_FILE = os.path.join(MEMORY_DIR, "whole_history.json")
+WHOLE_HISTORY_STATS_FILE = os.path.join(MEMORY_DIR, "whole_history_stats.json")
+RUNTIME_CONFIG_FILE = os.path.join(MEMORY_DIR, "runtime_config.json")
+HISTORY_CONTEXT_FILE = os.path.join(MEMORY_DIR, "history_context.json")
+LEGACY_MEMORY_INDEX_META_FILE = os.path.join(MEMORY_DIR, "embeddings.jsonl")
+
+# Response Cache Configuration
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))  # 1 hour
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("true", "1", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 1536))  # must match EMBEDDING_MODEL
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 512))  # inputs per embeddings request
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 5))  # in-flight embeddings requests
+
+# Memory Retrieval Configuration
+MEMORY_RETRIEVAL_ENABLED = os.getenv("MEMORY_RETRIEVAL_ENABLED", "true").lower() in ("true", "1", "yes")
+MEMORY_RETRIEVAL_TOP_K = int(os.getenv("MEMORY_RETRIEVAL_TOP_K", 8))  # past turns injected per request
+MEMORY_INDEX_DTYPE = os.getenv("MEMORY_INDEX_DTYPE", "int8").lower()  # int8 (per-vector scale), float16 or float32
+if MEMORY_INDEX_DTYPE not in ("int8", "float16", "float32"):
+    raise ValueError(f"Unsupported MEMORY_INDEX_DTYPE: {MEMORY_INDEX_DTYPE}")
+# One vector file and its own entry file per storage type, so the two always pair up;
+# switching types starts an empty index that /analyze refills
+MEMORY_INDEX_FILE = os.path.join(MEMORY_DIR, f"embeddings.{MEMORY_INDEX_DTYPE}")
+MEMORY_INDEX_META_FILE = os.path.join(MEMORY_DIR, f"embeddings.{MEMORY_INDEX_DTYPE}.jsonl")
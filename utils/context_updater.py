@@ -1,26 +1,29 @@
 import asyncio
-import json
+import logging
 from datetime import datetime
 from config.settings import (
-    MID_TERM_FILE,
     HISTORY_CONTEXT_FILE,
-    MID_TERM_MESSAGE_LIMIT
+    MID_TERM_MESSAGE_LIMIT,
+    SUMMARY_MODEL
 )
-from openai import OpenAI
-from config.settings import OPENAI_API_KEY
+from utils.openai_client import get_openai_client
+from utils.memory_manager import get_memory_manager, dump_json, load_cached
+from utils.file_writer import write_atomic
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+client = get_openai_client()
 
 async def generate_context_summary(messages):
-    """Generate a summary of key facts from messages using GPT-4"""
+    """Generate a summary of key facts from messages"""
     prompt = """Analyze these conversation messages and extract key facts and context. 
     Focus on important information that might be relevant for future conversations.
     Format the output as a list of concise facts."""
     
     messages_text = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
     
-    response = client.chat.completions.create(
-        model="gpt-4",
+    response = await client.chat.completions.create(
+        model=SUMMARY_MODEL,
         messages=[
             {"role": "system", "content": prompt},
             {"role": "user", "content": messages_text}
@@ -33,34 +36,33 @@ async def update_history_context():
     """Periodically analyze mid-term memory and update history context"""
     while True:
         try:
-            # Load mid-term memory
-            with open(MID_TERM_FILE, 'r') as f:
-                mid_term = json.load(f)
+            # Mid-term memory is held in RAM by the memory manager
+            memory_manager = get_memory_manager()
+            # A snapshot: turns keep moving into mid-term while the summary is generated
+            mid_term = list(memory_manager.mid_term)
             
             if len(mid_term) >= MID_TERM_MESSAGE_LIMIT:
                 # Generate summary
                 summary = await generate_context_summary(mid_term)
                 
-                # Load and update history context
-                with open(HISTORY_CONTEXT_FILE, 'r') as f:
-                    history_context = json.load(f)
+                # Load and update history context (a copy: the cached list is shared read-only)
+                history_context = list(load_cached(HISTORY_CONTEXT_FILE))
                 
                 history_context.append({
                     "summary": summary,
                     "timestamp": datetime.now().isoformat(),
+                    "type": "mid_term_summary",
                     "message_count": len(mid_term)
                 })
                 
                 # Save updated history context
-                with open(HISTORY_CONTEXT_FILE, 'w') as f:
-                    json.dump(history_context, f, indent=4)
+                await asyncio.to_thread(write_atomic, HISTORY_CONTEXT_FILE, dump_json(history_context))
                 
-                # Clear mid-term memory
-                with open(MID_TERM_FILE, 'w') as f:
-                    json.dump([], f)
+                # Drop only the summarized messages from mid-term memory
+                memory_manager.remove_from_mid_term(mid_term)
         
         except Exception as e:
-            print(f"Error updating history context: {e}")
+            logger.error(f"Error updating history context: {e}", exc_info=True)
         
         # Wait for 6 hours before next update
         await asyncio.sleep(6 * 3600) 
\ No newline at end of file
@@ -0,0 +1,19 @@
+from typing import List
+import numpy as np
+from config.settings import EMBEDDING_MODEL
+from utils.openai_client import get_openai_client
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts in one request and return L2-normalized float32 rows"""
+    response = await get_openai_client().embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts
+    )
+    vectors = np.asarray([item.embedding for item in response.data], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+async def embed_text(text: str) -> np.ndarray:
+    """Embed a single text"""
+    return (await embed_texts([text]))[0]
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import os
+import uuid
+from functools import lru_cache
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+def write_atomic(file_path: str, data: bytes) -> None:
+    """Replace a file in one step, so readers never see a partly written file"""
+    # A temp file of its own per call, so concurrent writers of one path can't publish each other's
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "xb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class FileWriter:
+    """Writes whole-file snapshots from a background task, off the event loop.
+
+    Only the latest snapshot of each path is kept, so rapid successive saves of
+    the same file cost one write. Until start() is called (and after stop()),
+    writes happen synchronously.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, bytes] = {}
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    def write(self, file_path: str, data: bytes) -> None:
+        if self._task is None:
+            write_atomic(file_path, data)
+            return
+        self._pending[file_path] = data
+        self._wakeup.set()
+
+    def start(self) -> None:
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write out everything still pending and stop the background task"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            if self._pending:
+                # One write per path at a time, so a newer snapshot can't be overtaken by an older one
+                file_path, data = self._pending.popitem()
+                try:
+                    await asyncio.to_thread(write_atomic, file_path, data)
+                except Exception as e:
+                    logger.error(f"Error writing {file_path}: {e}", exc_info=True)
+                continue
+            if self._closing:
+                return
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+@lru_cache(maxsize=1)
+def get_file_writer() -> FileWriter:
+    """Return the process-wide FileWriter"""
+    return FileWriter()
@@ -1,30 +1,48 @@
 import os
-import json
+import orjson
 from config.settings import (
     MEMORY_DIR,
     SHORT_TERM_FILE,
     MID_TERM_FILE,
     WHOLE_HISTORY_FILE,
+    LEGACY_WHOLE_HISTORY_FILE,
     HISTORY_CONTEXT_FILE
 )
 
+def migrate_whole_history():
+    """Convert a legacy whole_history.json array into the append-only JSON Lines log"""
+    if os.path.exists(WHOLE_HISTORY_FILE) or not os.path.exists(LEGACY_WHOLE_HISTORY_FILE):
+        return
+
+    with open(LEGACY_WHOLE_HISTORY_FILE, 'rb') as f:
+        whole_history = orjson.loads(f.read())
+
+    with open(WHOLE_HISTORY_FILE, 'wb') as f:
+        f.write(b"".join(orjson.dumps(msg, option=orjson.OPT_APPEND_NEWLINE) for msg in whole_history))
+
+    os.remove(LEGACY_WHOLE_HISTORY_FILE)
+
 def init_memory_files():
     """Initialize memory directory and files if they don't exist"""
     # Create memory directory
     os.makedirs(MEMORY_DIR, exist_ok=True)
+    migrate_whole_history()
     
     # Initialize files with empty structures
     memory_files = [
         SHORT_TERM_FILE,
         MID_TERM_FILE,
-        WHOLE_HISTORY_FILE,
         HISTORY_CONTEXT_FILE
     ]
     
     for file in memory_files:
         if not os.path.exists(file):
-            with open(file, 'w') as f:
-                json.dump([], f)
+            with open(file, 'wb') as f:
+                f.write(orjson.dumps([]))
+
+    # The whole history is a JSON Lines log, so it starts out as an empty file
+    if not os.path.exists(WHOLE_HISTORY_FILE):
+        open(WHOLE_HISTORY_FILE, 'w').close()
 
 if __name__ == "__main__":
-    init_memory_files() 
\ No newline at end of file
+    init_memory_files() 
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import orjson
+import numpy as np
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from config.settings import (
+    MEMORY_INDEX_FILE,
+    MEMORY_INDEX_META_FILE,
+    LEGACY_MEMORY_INDEX_META_FILE,
+    WHOLE_HISTORY_FILE,
+    EMBEDDING_DIMENSIONS,
+    MEMORY_INDEX_DTYPE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY
+)
+from utils.embeddings import embed_texts
+from utils.memory_manager import load_jsonl, message_text
+
+logger = logging.getLogger(__name__)
+
+class MemoryIndex:
+    """Embeddings of past turns for retrieval, kept in RAM and appended to disk.
+
+    Row i of MEMORY_INDEX_FILE belongs to line i of MEMORY_INDEX_META_FILE (the
+    turn it was computed from). Rows are stored as MEMORY_INDEX_DTYPE; int8 rows
+    carry a per-vector scale, cutting RAM and disk use 4x against float32.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIMENSIONS, dtype: str = MEMORY_INDEX_DTYPE):
+        self.dim = dim
+        self.quantized = dtype == "int8"
+        self.row_dtype = np.dtype([("scale", "<f4"), ("vector", dtype, (dim,))])
+        rows = self._load_rows()
+        self.entries = self._load_entries(len(rows))
+
+        size = min(len(rows), len(self.entries))
+        if len(rows) != len(self.entries):
+            # A crash between the two appends leaves one file longer; keep the common prefix
+            logger.warning(f"Memory index files disagree ({len(rows)} vectors, {len(self.entries)} entries), truncating to {size}")
+            del self.entries[size:]
+            rows = rows[:size]
+            self._rewrite(rows)
+
+        # Over-allocated (rows and their timestamps alike) so appends don't copy every turn
+        capacity = max(2 * size, 1024)
+        self._rows = np.empty(capacity, dtype=self.row_dtype)
+        self._rows[:size] = rows
+        self._timestamps = np.empty(capacity, dtype=np.float64)
+        self._timestamps[:size] = [entry["timestamp"] for entry in self.entries]
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _load_entries(self, row_count: int) -> List[Dict[str, Any]]:
+        if not os.path.exists(MEMORY_INDEX_META_FILE) and os.path.exists(LEGACY_MEMORY_INDEX_META_FILE):
+            # The entry file used to be shared by all storage types; it only belongs to
+            # this vector file if they line up, otherwise the index is rebuilt by /analyze
+            legacy_entries = load_jsonl(LEGACY_MEMORY_INDEX_META_FILE)
+            if len(legacy_entries) == row_count:
+                os.replace(LEGACY_MEMORY_INDEX_META_FILE, MEMORY_INDEX_META_FILE)
+                return legacy_entries
+            logger.warning(f"Ignoring {LEGACY_MEMORY_INDEX_META_FILE}: {len(legacy_entries)} entries for {row_count} vectors")
+            return []
+        return load_jsonl(MEMORY_INDEX_META_FILE)
+
+    def _load_rows(self) -> np.ndarray:
+        try:
+            with open(MEMORY_INDEX_FILE, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return np.empty(0, dtype=self.row_dtype)
+        # Drop a partially written last row
+        count = len(data) // self.row_dtype.itemsize
+        return np.frombuffer(data, dtype=self.row_dtype, count=count)
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        rows = np.empty(len(vectors), dtype=self.row_dtype)
+        if self.quantized:
+            # Symmetric int8 per vector: the largest component maps to +-127
+            scale = np.abs(vectors).max(axis=1) / 127
+            scale[scale == 0] = 1.0
+            rows["scale"] = scale
+            rows["vector"] = np.rint(vectors / scale[:, None])
+        else:
+            rows["scale"] = 1.0
+            rows["vector"] = vectors
+        return rows
+
+    def _rewrite(self, rows: np.ndarray) -> None:
+        with open(MEMORY_INDEX_FILE, "wb") as f:
+            f.write(rows.tobytes())
+        with open(MEMORY_INDEX_META_FILE, "wb") as f:
+            f.write(b"".join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in self.entries))
+
+    def add(self, vectors: np.ndarray, entries: List[Dict[str, Any]]) -> None:
+        """Append normalized vectors (one row per entry) and persist them"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}; check EMBEDDING_DIMENSIONS")
+        rows = self._encode(vectors)
+        count = len(rows)
+        size = self._size
+        if size + count > len(self._rows):
+            capacity = max(2 * len(self._rows), size + count)
+            grown = np.empty(capacity, dtype=self.row_dtype)
+            grown[:size] = self._rows[:size]
+            self._rows = grown
+            grown_timestamps = np.empty(capacity, dtype=np.float64)
+            grown_timestamps[:size] = self._timestamps[:size]
+            self._timestamps = grown_timestamps
+        self._rows[size:size + count] = rows
+        self._timestamps[size:size + count] = [entry["timestamp"] for entry in entries]
+        self.entries.extend(entries)
+        self._size = size + count
+
+        with open(MEMORY_INDEX_FILE, "ab") as f:
+            f.write(rows.tobytes())
+        with open(MEMORY_INDEX_META_FILE, "ab") as f:
+            f.write(b"".join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries))
+
+    def search(self, query: np.ndarray, k: int, before: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Top-k entries by cosine similarity, oldest first.
+
+        Entries from `before` onwards are skipped, since those turns are already in the prompt.
+        """
+        if not self._size or k <= 0:
+            return []
+
+        # Vectors are normalized, so the (rescaled) dot product is the cosine similarity
+        rows = self._rows[:self._size]
+        scores = (rows["vector"] @ query.astype(np.float32)) * rows["scale"]
+        if before is not None:
+            scores[self._timestamps[:self._size] >= before] = -np.inf
+
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.isfinite(scores[top])]
+        return [self.entries[i] for i in sorted(top, key=lambda i: self._timestamps[i])]
+
+    def indexed_timestamps(self) -> set:
+        return set(self._timestamps[:self._size].tolist())
+
+@lru_cache(maxsize=1)
+def get_memory_index() -> MemoryIndex:
+    """Return the process-wide MemoryIndex"""
+    return MemoryIndex()
+
+# Serializes backfills, so overlapping /analyze calls can't both add the same turns
+backfill_lock = asyncio.Lock()
+
+async def backfill_memory_index() -> int:
+    """Embed the turns of the whole history that are not in the memory index yet.
+
+    Returns the number of turns added.
+    """
+    async with backfill_lock:
+        return await _backfill_missing_turns()
+
+async def _backfill_missing_turns() -> int:
+    index = get_memory_index()
+    indexed = index.indexed_timestamps()
+    history = await asyncio.to_thread(load_jsonl, WHOLE_HISTORY_FILE)
+
+    # A turn is a user message followed by the assistant reply, stored with the same timestamp
+    turns = [
+        {"user": message_text(user_msg), "assistant": message_text(assistant_msg), "timestamp": user_msg["timestamp"]}
+        for user_msg, assistant_msg in zip(history, history[1:])
+        if user_msg.get("role") == "user"
+        and assistant_msg.get("role") == "assistant"
+        and user_msg["timestamp"] not in indexed
+    ]
+    if not turns:
+        return 0
+
+    # Many inputs per request, a few requests in flight at once
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    async def embed_batch(batch: List[Dict[str, Any]]) -> np.ndarray:
+        async with semaphore:
+            return await embed_texts([turn["user"] for turn in batch])
+
+    batches = [turns[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(turns), EMBEDDING_BATCH_SIZE)]
+    vectors = np.concatenate(await asyncio.gather(*(embed_batch(batch) for batch in batches)))
+
+    # Replies indexed by the chat path while the batches were in flight
+    indexed = index.indexed_timestamps()
+    keep = [i for i, turn in enumerate(turns) if turn["timestamp"] not in indexed]
+    if not keep:
+        return 0
+    turns = [turns[i] for i in keep]
+    index.add(vectors[keep], turns)
+    logger.info(f"Added {len(turns)} turns from the whole history to the memory index")
+    return len(turns)
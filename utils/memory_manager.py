@@ -1,32 +1,255 @@
-import json
+import hashlib
+import orjson
 import time
 import os
-from typing import List, Dict, Any
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Callable
 from config.settings import (
     SHORT_TERM_FILE,
     MID_TERM_FILE,
     WHOLE_HISTORY_FILE,
+    WHOLE_HISTORY_STATS_FILE,
+    RUNTIME_CONFIG_FILE,
     HISTORY_CONTEXT_FILE,
-    SESSION_DURATION,
     MID_TERM_MESSAGE_LIMIT,
-    MEMORY_DIR
+    SHORT_TERM_MESSAGE_LIMIT,
+    MAX_CONTEXT_TURNS,
+    SHORT_TERM_SAVE_INTERVAL,
+    PRETTY_JSON,
+    runtime_config
 )
+from utils.init_memory import init_memory_files
+from utils.file_writer import get_file_writer
+from utils.tokens import count_tokens
+
+def dump_json(data: Any) -> bytes:
+    """Serialize a memory file compactly, or indented when PRETTY_JSON is set for debugging"""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 if PRETTY_JSON else 0)
+
+def load_json(file_path: str) -> Any:
+    try:
+        with open(file_path, "rb") as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return []
+
+def load_jsonl(file_path: str) -> List[Dict[str, Any]]:
+    """Load an append-only JSON Lines file, one message per line"""
+    try:
+        with open(file_path, "rb") as f:
+            return [orjson.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def read_jsonl_from(file_path: str, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+    """Read the complete JSON Lines records after a byte offset.
+
+    Returns the records and the offset to resume from; a partially written last line is left for the next read.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+
+    end = data.rfind(b"\n") + 1
+    records = [orjson.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return records, offset + end
+
+def message_text(msg: Dict[str, Any]) -> str:
+    content = msg.get("content", "")
+    # Older turns were stored with the whole message dict as their content
+    if isinstance(content, dict):
+        content = content.get("content", "")
+    return str(content)
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    """Token count of a stored message, counted once and kept on the message"""
+    tokens = msg.get("tokens")
+    if tokens is None:
+        # Messages stored before counts were kept get theirs on first use
+        tokens = msg["tokens"] = count_tokens(message_text(msg))
+    return tokens
+
+# file path -> ((st_mtime_ns, st_size), parsed data)
+_file_cache: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+
+def load_cached(file_path: str, loader: Callable[[str], Any] = load_json) -> Any:
+    """Parse a memory file only when it changed since the last read.
+
+    The parsed object is shared between callers, so it must be treated as read-only.
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        _file_cache.pop(file_path, None)
+        return []
+
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _file_cache.get(file_path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    data = loader(file_path)
+    _file_cache[file_path] = (version, data)
+    return data
 
 class MemoryManager:
     def __init__(self):
-        # Ensure memory directory exists
-        os.makedirs(MEMORY_DIR, exist_ok=True)
+        # Ensure memory directory and files exist (and the whole history is migrated to JSONL)
+        init_memory_files()
+
+        # A session duration chosen with /session survives restarts
+        saved_config = load_json(RUNTIME_CONFIG_FILE)
+        if isinstance(saved_config, dict) and "session_duration" in saved_config:
+            runtime_config.session_duration = int(saved_config["session_duration"])
+
+        # Short-term memory lives in RAM and is persisted every few turns
+        self.short_term = self._load_memory(SHORT_TERM_FILE)
+        self._unsaved_turns = 0
+        # Digests of the messages a prompt replays, so the cache key never rehashes their content
+        self._recent_digests = [self._message_digest(msg) for msg in self.short_term[-MAX_CONTEXT_TURNS * 2:]]
+        self._recent_state = self._digest_state(self._recent_digests)
+
+        # Mid-term memory lives in RAM and is written through when it changes
+        self.mid_term = self._load_memory(MID_TERM_FILE)
+
+        # Running per-role counters so the stats commands never scan the message lists
+        self.stats = {
+            "short": self._count_roles(self.short_term),
+            "mid": self._count_roles(self.mid_term),
+            "whole": self._load_whole_history_stats()
+        }
+
+        # (entries, joined summary) of the last history context read
+        self._history_summary_cache = (None, "")
         
     def _load_memory(self, file_path: str) -> List[Dict[str, Any]]:
+        return [self._normalize_stored_msg(msg) for msg in load_json(file_path)]
+
+    @staticmethod
+    def _normalize_stored_msg(msg: Dict[str, Any]) -> Dict[str, Any]:
+        """Make content a plain string, so readers never have to unwrap it"""
+        if not isinstance(msg.get("content"), str):
+            msg["content"] = message_text(msg)
+        return msg
+
+    def _save_memory(self, file_path: str, data: List[Dict[str, Any]]) -> None:
+        # Serialized now, written by the background writer (atomically, latest snapshot wins)
+        get_file_writer().write(file_path, dump_json(data))
+
+    def _append_history(self, messages: List[Dict[str, Any]]) -> None:
+        # One small append per turn instead of rewriting the whole history
+        with open(WHOLE_HISTORY_FILE, "ab") as f:
+            f.write(b"".join(orjson.dumps(msg, option=orjson.OPT_APPEND_NEWLINE) for msg in messages))
+            size = f.tell()
+
+        stats = self.stats["whole"]
+        self._count_roles(messages, stats)
+        if stats["first_timestamp"] is None:
+            stats["first_timestamp"] = messages[0]["timestamp"]
+        stats["last_timestamp"] = messages[-1]["timestamp"]
+        stats["size"] = size
+
+    @staticmethod
+    def _count_roles(
+        messages: List[Dict[str, Any]],
+        counts: Dict[str, Any] = None,
+        sign: int = 1
+    ) -> Dict[str, Any]:
+        """Add (or with sign=-1, subtract) messages to per-role counters"""
+        if counts is None:
+            counts = {"total": 0, "user": 0, "assistant": 0}
+        # Counter tallies in C, which matters when rebuilding from a long whole history
+        roles = Counter(msg.get("role") for msg in messages)
+        counts["total"] += sign * len(messages)
+        counts["user"] += sign * roles["user"]
+        counts["assistant"] += sign * roles["assistant"]
+        return counts
+
+    def _load_whole_history_stats(self) -> Dict[str, Any]:
+        """Read the whole-history counters from their sidecar, rebuilding them if it is stale"""
+        stats = load_json(WHOLE_HISTORY_STATS_FILE) or {}
         try:
-            with open(file_path, "r") as f:
-                return json.load(f)
+            size = os.path.getsize(WHOLE_HISTORY_FILE)
         except FileNotFoundError:
-            return []
+            size = 0
+        if stats.get("size") == size:
+            return stats
 
-    def _save_memory(self, file_path: str, data: List[Dict[str, Any]]) -> None:
-        with open(file_path, "w") as f:
-            json.dump(data, ensure_ascii=False, indent=4, fp=f)
+        # The sidecar is only saved on flush, so rescan the log once after a crash or migration
+        whole_history = load_jsonl(WHOLE_HISTORY_FILE)
+        stats = self._count_roles(whole_history)
+        stats["first_timestamp"] = whole_history[0]["timestamp"] if whole_history else None
+        stats["last_timestamp"] = whole_history[-1]["timestamp"] if whole_history else None
+        stats["size"] = size
+        self._save_memory(WHOLE_HISTORY_STATS_FILE, stats)
+        return stats
+
+    def get_stats(self, tier: str) -> Dict[str, Any]:
+        """Message counts and time range of the "short", "mid" or "whole" memory tier"""
+        counts = self.stats[tier]
+        if tier == "whole":
+            first, last = counts["first_timestamp"], counts["last_timestamp"]
+        else:
+            messages = self.short_term if tier == "short" else self.mid_term
+            first, last = (messages[0]["timestamp"], messages[-1]["timestamp"]) if messages else (None, None)
+
+        return {
+            "total_messages": counts["total"],
+            "user_messages": counts["user"],
+            "assistant_messages": counts["assistant"],
+            "time_range": f"{first} - {last}" if counts["total"] else "No messages"
+        }
+
+    @staticmethod
+    def _message_digest(msg: Dict[str, Any]) -> bytes:
+        return hashlib.blake2b(orjson.dumps([msg["role"], msg["content"]]), digest_size=16).digest()
+
+    @staticmethod
+    def _digest_state(digests: List[bytes]) -> str:
+        return f"{len(digests)}:{hashlib.blake2b(b''.join(digests), digest_size=16).hexdigest()}"
+
+    @property
+    def recent_turns_state(self) -> str:
+        """Identifies the last MAX_CONTEXT_TURNS turns of short-term memory, the ones a prompt replays"""
+        return self._recent_state
+
+    def flush(self) -> None:
+        """Persist the in-memory short-term window and the whole-history counters"""
+        self._save_memory(SHORT_TERM_FILE, self.short_term)
+        self._save_memory(WHOLE_HISTORY_STATS_FILE, self.stats["whole"])
+        self._unsaved_turns = 0
+
+    def set_session_duration(self, seconds: int) -> None:
+        """Change how long messages stay in short-term memory and persist the choice"""
+        runtime_config.session_duration = seconds
+        self._save_memory(RUNTIME_CONFIG_FILE, {"session_duration": seconds})
+
+    def clear_short_term(self) -> None:
+        self.short_term = []
+        self._recent_digests = []
+        self._recent_state = self._digest_state([])
+        self.stats["short"] = self._count_roles([])
+        self.flush()
+
+    def remove_from_mid_term(self, messages: List[Dict[str, Any]]) -> None:
+        """Drop messages that were summarized, keeping any that moved in meanwhile.
+
+        The summarized messages were the oldest ones, so whatever is left of them
+        (trimming may already have dropped some) is a prefix of mid-term memory.
+        """
+        summarized = {id(msg) for msg in messages}
+        mid_term = self.mid_term
+        count = 0
+        while count < len(mid_term) and id(mid_term[count]) in summarized:
+            count += 1
+        self._count_roles(mid_term[:count], self.stats["mid"], sign=-1)
+        del mid_term[:count]
+        self._save_memory(MID_TERM_FILE, mid_term)
 
     def update_memory(self, user_input: str, assistant_response: str) -> None:
         current_time = time.time()
@@ -34,45 +257,63 @@ class MemoryManager:
             {"role": "user", "content": user_input, "timestamp": current_time},
             {"role": "assistant", "content": assistant_response, "timestamp": current_time}
         ]
+        # Normalize and count tokens once at write time so readers only copy strings and sum integers
+        for msg in message_pair:
+            self._normalize_stored_msg(msg)
+            message_tokens(msg)
 
         # Update whole history
-        whole_history = self._load_memory(WHOLE_HISTORY_FILE)
-        whole_history.extend(message_pair)
-        self._save_memory(WHOLE_HISTORY_FILE, whole_history)
+        self._append_history(message_pair)
 
         # Update short-term memory
-        short_term = self._load_memory(SHORT_TERM_FILE)
+        short_term = self.short_term
         short_term.extend(message_pair)
+        self._count_roles(message_pair, self.stats["short"])
         
-        # Filter out old messages from short-term
-        current_time = time.time()
-        short_term = [
-            msg for msg in short_term 
-            if current_time - msg["timestamp"] <= SESSION_DURATION
-        ]
-        self._save_memory(SHORT_TERM_FILE, short_term)
+        # Messages are appended in timestamp order, so the expired ones form a prefix
+        cutoff = current_time - runtime_config.session_duration
+        expired = bisect_left(short_term, cutoff, key=lambda msg: msg["timestamp"])
+        # A busy session must not grow the window (and every save of it) without bound
+        expired = max(expired, len(short_term) - SHORT_TERM_MESSAGE_LIMIT)
+        moved_to_mid = short_term[:expired]
+        del short_term[:expired]
+        self._count_roles(moved_to_mid, self.stats["short"], sign=-1)
+
+        # Only the newest messages are replayed, so only their digests make up the state
+        recent = self._recent_digests
+        recent.extend(self._message_digest(msg) for msg in message_pair)
+        del recent[:len(recent) - min(len(short_term), MAX_CONTEXT_TURNS * 2)]
+        self._recent_state = self._digest_state(recent)
+        self._unsaved_turns += 1
+        if self._unsaved_turns >= SHORT_TERM_SAVE_INTERVAL:
+            self.flush()
 
         # Move old messages to mid-term
-        mid_term = self._load_memory(MID_TERM_FILE)
-        moved_to_mid = [
-            msg for msg in short_term 
-            if current_time - msg["timestamp"] > SESSION_DURATION
-        ]
-        
         if moved_to_mid:
+            mid_term = self.mid_term
             mid_term.extend(moved_to_mid)
+            self._count_roles(moved_to_mid, self.stats["mid"])
             # Keep only the last MID_TERM_MESSAGE_LIMIT messages
-            mid_term = mid_term[-MID_TERM_MESSAGE_LIMIT:]
+            dropped = len(mid_term) - MID_TERM_MESSAGE_LIMIT
+            if dropped > 0:
+                self._count_roles(mid_term[:dropped], self.stats["mid"], sign=-1)
+                del mid_term[:dropped]
             self._save_memory(MID_TERM_FILE, mid_term)
 
-    def get_context(self) -> List[Dict[str, str]]:
-        short_term = self._load_memory(SHORT_TERM_FILE)
-        history_context = self._load_memory(HISTORY_CONTEXT_FILE)
-        
-        # Convert timestamps to readable format for the context
-        formatted_short_term = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in short_term
-        ]
-        
-        return formatted_short_term, history_context 
\ No newline at end of file
+    def get_history_context(self) -> List[Dict[str, Any]]:
+        # The analyzers rewrite HISTORY_CONTEXT_FILE directly; load_cached notices via its mtime
+        return load_cached(HISTORY_CONTEXT_FILE)
+
+    def get_history_summary(self) -> str:
+        """Joined history-context summaries, recomputed only when the history context changes"""
+        history_context = self.get_history_context()
+        cached_context, summary = self._history_summary_cache
+        if history_context is not cached_context:
+            summary = "\n".join(fact["summary"] for fact in history_context)
+            self._history_summary_cache = (history_context, summary)
+        return summary
+
+@lru_cache(maxsize=1)
+def get_memory_manager() -> MemoryManager:
+    """Return the process-wide MemoryManager, which owns the in-memory copies of the memory files"""
+    return MemoryManager()
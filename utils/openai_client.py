@@ -0,0 +1,21 @@
+from functools import lru_cache
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from config.settings import OPENAI_API_KEY, OPENAI_TIMEOUT
+
+# Keep enough warm connections for concurrent chats so requests don't pay a new TLS handshake
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=300)
+
+# Fail fast on unreachable hosts; with streaming the read timeout is the gap between chunks,
+# so a stalled request frees its connection instead of holding it for the SDK's 10 minute default
+HTTP_TIMEOUT = httpx.Timeout(OPENAI_TIMEOUT, connect=5.0)
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    """Return the process-wide OpenAI client so every module shares one connection pool"""
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        timeout=HTTP_TIMEOUT,
+        # HTTP/2 multiplexes concurrent completions over one TLS connection
+        http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS, http2=True)
+    )
@@ -0,0 +1,104 @@
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config.settings import (
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_THRESHOLD
+)
+
+class ResponseCache:
+    """Two-tier cache of assistant responses: exact prompt hash first, then embedding similarity.
+
+    Semantic entries are grouped by scope (a hash of the conversation context and the
+    recently replayed turns) so a similar question is only answered from cache
+    when it was asked at the same point of the same conversation; a bare follow-up such
+    as "why?" must never pick up an answer given in another conversation.
+    """
+
+    def __init__(
+        self,
+        ttl: int = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._exact: Dict[str, Tuple[float, str]] = {}
+        self._semantic: Dict[str, List[Tuple[float, np.ndarray, str]]] = {}
+
+    @staticmethod
+    def _hash(*parts: str) -> str:
+        return hashlib.blake2b("|".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+    @classmethod
+    def scope_for(cls, model: str, system_prompt: str, context_text: str) -> str:
+        """Scope of the semantic tier: everything that shapes an answer except the recent turns"""
+        return cls._hash(model, cls._hash(system_prompt), cls._hash(context_text))
+
+    @classmethod
+    def state_scope(cls, scope: str, conversation_state: str) -> str:
+        """Semantic scope narrowed to one conversation state"""
+        return cls._hash(scope, conversation_state)
+
+    @classmethod
+    def make_key(cls, scope: str, conversation_state: str, user_input: str) -> str:
+        """Exact key over the conversation state, so any change to the replayed turns misses"""
+        return cls._hash(scope, conversation_state, user_input)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._exact.get(key)
+        if entry is None:
+            return None
+        expires_at, response = entry
+        if expires_at < time.time():
+            del self._exact[key]
+            return None
+        # Move hits to the end, so eviction drops the least recently used entry
+        self._exact[key] = self._exact.pop(key)
+        return response
+
+    def get_similar(self, scope: str, embedding: np.ndarray) -> Optional[str]:
+        now = time.time()
+        entries = [e for e in self._semantic.get(scope, []) if e[0] >= now]
+        if not entries:
+            self._semantic.pop(scope, None)
+            return None
+        self._semantic[scope] = entries
+
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        scores = np.stack([e[1] for e in entries]) @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            return entries[best][2]
+        return None
+
+    def put(
+        self,
+        key: str,
+        response: str,
+        scope: Optional[str] = None,
+        embedding: Optional[np.ndarray] = None
+    ) -> None:
+        expires_at = time.time() + self.ttl
+
+        self._exact.pop(key, None)
+        self._exact[key] = (expires_at, response)
+        while len(self._exact) > self.max_entries:
+            # Dicts keep insertion order, so the first key is the least recently used entry
+            del self._exact[next(iter(self._exact))]
+
+        if scope is not None and embedding is not None:
+            # The newest entry of a scope expires last; drop scopes that are fully stale
+            now = time.time()
+            for stale in [s for s, e in self._semantic.items() if e[-1][0] < now]:
+                del self._semantic[stale]
+
+            entries = self._semantic.setdefault(scope, [])
+            entries.append((expires_at, embedding, response))
+            del entries[:-self.max_entries]
+            # Every turn opens a new scope; drop the oldest ones beyond the entry limit
+            while len(self._semantic) > self.max_entries:
+                del self._semantic[next(iter(self._semantic))]
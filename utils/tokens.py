@@ -0,0 +1,48 @@
+import logging
+import time
+import tiktoken
+from typing import Any, Dict, List, Optional
+from config.settings import CHAT_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Loaded tokenizer, and when loading it last failed
+_encoding: Optional[tiktoken.Encoding] = None
+_failed_at = float("-inf")
+
+# Seconds before a failed tokenizer load is retried
+LOAD_RETRY_INTERVAL = 60
+
+def get_encoding() -> Optional[tiktoken.Encoding]:
+    """Tokenizer of the chat model, loaded once per process (None while it cannot be loaded)"""
+    global _encoding, _failed_at
+    if _encoding is not None or time.monotonic() - _failed_at < LOAD_RETRY_INTERVAL:
+        return _encoding
+    try:
+        try:
+            _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+        except KeyError:
+            # Unknown model name, fall back to the encoding of the current OpenAI chat models
+            _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; a failure is retried later
+        # instead of leaving the process on estimated counts until it restarts
+        _failed_at = time.monotonic()
+        logger.warning(f"Could not load tokenizer, estimating token counts: {e}")
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        # Roughly 4 characters per token for English text
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def trim_to_token_budget(messages: List[Dict[str, Any]], counts: List[int], budget: int) -> List[Dict[str, Any]]:
+    """Drop the oldest messages until the rest fit in budget tokens, given each message's token count"""
+    total = sum(counts)
+    start = 0
+    while start < len(messages) and total > budget:
+        total -= counts[start]
+        start += 1
+    return messages[start:]
@@ -1,39 +1,91 @@
-import json
+import orjson
+import os
 from datetime import datetime
 import asyncio
+import logging
 from config.settings import (
     WHOLE_HISTORY_FILE,
-    HISTORY_CONTEXT_FILE
+    HISTORY_CONTEXT_FILE,
+    SUMMARY_MODEL
 )
-from openai import OpenAI
-from config.settings import OPENAI_API_KEY
+from utils.openai_client import get_openai_client
+from utils.memory_manager import load_cached, load_jsonl, read_jsonl_from, dump_json, message_text
+from utils.file_writer import write_atomic
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+client = get_openai_client()
+
+# Serializes analyses: a run started while another is in flight waits for it and
+# then only summarizes whatever arrived in between (usually nothing)
+analysis_lock = asyncio.Lock()
+
+def load_global_summary():
+    """Return the last global summary entry from the history context, if any"""
+    try:
+        history_context = load_cached(HISTORY_CONTEXT_FILE)
+    except orjson.JSONDecodeError:
+        return None
+
+    for entry in reversed(history_context):
+        if entry.get("type") == "global_summary":
+            return entry
+    return None
 
 async def analyze_whole_history():
-    """Analyze entire conversation history and update history context"""
+    """Fold the messages added since the last global summary into that summary"""
+    async with analysis_lock:
+        await _analyze_new_messages()
+
+async def _analyze_new_messages():
     try:
-        # Load whole history
-        with open(WHOLE_HISTORY_FILE, 'r') as f:
-            whole_history = json.load(f)
-        
-        if not whole_history:
+        # byte_offset of the previous summary is the watermark of what it already covers
+        previous = load_global_summary()
+        summarized_count = previous.get("message_count", 0) if previous else 0
+        offset = previous.get("byte_offset") if previous else 0
+
+        try:
+            history_size = os.path.getsize(WHOLE_HISTORY_FILE)
+        except FileNotFoundError:
+            history_size = 0
+        if offset is not None and offset > history_size:
+            # History was reset, start over
+            previous, summarized_count, offset = None, 0, 0
+
+        if offset is None:
+            # Summary written before byte offsets were tracked: skip its messages once by count
+            whole_history = await asyncio.to_thread(load_jsonl, WHOLE_HISTORY_FILE)
+            if summarized_count > len(whole_history):
+                previous, summarized_count = None, 0
+            new_messages = whole_history[summarized_count:]
+            offset = history_size
+        else:
+            # Only read the part of the log appended since the last summary, parsed off the event loop
+            new_messages, offset = await asyncio.to_thread(read_jsonl_from, WHOLE_HISTORY_FILE, offset)
+
+        if not new_messages:
             return
         
-        # Prepare conversation history for analysis
+        # Prepare only the new part of the conversation for analysis
+        # message_text() unwraps turns logged before content was stored as a plain string
         history_text = "\n".join([
-            f"{msg['role']}: {msg['content']}" 
-            for msg in whole_history 
+            f"{msg['role']}: {message_text(msg)}" 
+            for msg in new_messages 
             if 'content' in msg
         ])
+        if previous:
+            history_text = (
+                f"Existing summary:\n{previous['summary']}\n\n"
+                f"New messages since that summary:\n{history_text}"
+            )
         
-        # Get GPT-4 to analyze the entire history
-        response = client.chat.completions.create(
-            model="gpt-4",
+        response = await client.chat.completions.create(
+            model=SUMMARY_MODEL,
             messages=[
                 {
                     "role": "system", 
                     "content": """Analyze the entire conversation history and create a comprehensive summary. 
+                    If an existing summary is provided, update it with the new messages instead of starting over.
                     Focus on:
                     1. Key recurring topics
                     2. Who are group of people you are talking to
@@ -50,16 +102,17 @@ async def analyze_whole_history():
         global_summary = response.choices[0].message.content
         
         # Update history context with new global summary
-        with open(HISTORY_CONTEXT_FILE, 'w') as f:
-            json.dump([{
-                "summary": global_summary,
-                "timestamp": datetime.now().isoformat(),
-                "type": "global_summary",
-                "message_count": len(whole_history)
-            }], f, indent=4)
+        history_context = dump_json([{
+            "summary": global_summary,
+            "timestamp": datetime.now().isoformat(),
+            "type": "global_summary",
+            "message_count": summarized_count + len(new_messages),
+            "byte_offset": offset
+        }])
+        await asyncio.to_thread(write_atomic, HISTORY_CONTEXT_FILE, history_context)
             
     except Exception as e:
-        print(f"Error analyzing whole history: {e}")
+        logger.error(f"Error analyzing whole history: {e}", exc_info=True)
 
 async def periodic_history_analysis():
     """Run whole history analysis periodically"""